@@ -1,20 +1,25 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime
+from datetime import date, datetime
 import hashlib
-import json
+import hmac
+import html
+import base64
+import copy
+import orjson
+import ijson
+import msgpack
 import random
 import os
+import stat
+import time
 import io
+import tempfile
+import threading
+from collections import deque, namedtuple
+from urllib.parse import quote, unquote
 from typing import Dict, List, Tuple
-import pulp
-from scipy.optimize import linprog
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import StandardScaler
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -29,38 +34,244 @@ st.set_page_config(
 
 # 用户数据文件路径
 USERS_FILE = "users.json"
-CHAT_DB = "chat_history.json"
+# 聊天记录目录：每个聊天一个JSONL文件，每行一条消息
+CHAT_DIR = "chats"
+# 旧版单文件聊天记录，首次启动时迁移到 CHAT_DIR
+LEGACY_CHAT_DB = "chat_history.json"
+# 用户上传的种植/效益数据目录：每个用户每类数据一个msgpack文件
+USER_DATA_DIR = "user_data"
+
+# 单个聊天记录超过上限时压缩为最近的消息
+CHAT_HISTORY_LIMIT = 1000
+CHAT_HISTORY_KEEP = 500
+# 聊天页面只显示最近的消息
+CHAT_DISPLAY_SIZE = 100
+
+PRESENCE_WINDOW = 300  # 秒
+
+
+@st.cache_resource(show_spinner=False)
+def presence_registry():
+    """在线状态表：用户名 -> 最近访问聊天页面的时间戳，及保护它的锁
+
+    脚本每次重运行都会重新执行，模块级变量不会保留，因此放在进程内所有会话共享的资源缓存中。
+    """
+    return {}, threading.Lock()
+
+
+def record_presence(username):
+    """记录用户在线状态，并清理超出在线窗口的旧记录"""
+    presence, lock = presence_registry()
+    now = time.time()
+    with lock:
+        presence[username] = now
+        for name in [name for name, seen in presence.items() if now - seen >= PRESENCE_WINDOW]:
+            del presence[name]
+
+
+def count_online_users():
+    """统计最近一段时间内访问过聊天页面的用户数"""
+    presence, lock = presence_registry()
+    now = time.time()
+    with lock:
+        return sum(1 for seen in presence.values() if now - seen < PRESENCE_WINDOW)
+
+
+# orjson 序列化选项：缩进输出，允许非字符串键
+JSON_DUMP_OPTS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+# 用户文件中保存的数据记录可能含有numpy数值，直接序列化而无需逐个转换
+USERS_DUMP_OPTS = JSON_DUMP_OPTS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE
+
+
+@st.cache_resource(show_spinner=False)
+def file_caches():
+    """进程内的文件缓存：以文件修改时间和大小为版本戳，文件变化后自动失效
+
+    脚本每次重运行都会重新执行，模块级变量不会保留，因此缓存字典放在资源缓存中，跨重运行和会话共享。
+    用户缓存的"entry"为 (版本戳, 用户字典, 文件内容) 元组，整体替换，其他会话不会读到不一致的组合。
+    """
+    users_cache = {"entry": None, "index": None}
+    chat_cache = {}  # 聊天记录文件路径 -> (版本戳, 消息列表)
+    user_data_cache = {}  # 用户数据文件路径 -> (版本戳, 记录列表)
+    return users_cache, chat_cache, user_data_cache
+
+
+_users_cache, _chat_cache, _user_data_cache = file_caches()
+
+
+def file_stamp(path):
+    """获取文件版本戳，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+@st.cache_resource(show_spinner=False)
+def process_umask():
+    """读取进程的umask，无法读取时返回None
+
+    os.umask只能先改后还原，改动期间其他会话线程新建的文件会得到过宽的权限，
+    因此从/proc读取而不修改它。
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def atomic_write(path, data: bytes) -> None:
+    """先写临时文件再替换，避免中途失败留下残缺文件"""
+    # 临时文件名唯一，多个会话同时保存时不会互相覆盖
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        # mkstemp创建的文件权限为0600，替换后会沿用；改为原文件的权限，新文件按umask默认权限
+        # （读不到umask时新文件保留0600）
+        if hasattr(os, "fchmod"):
+            try:
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+            except FileNotFoundError:
+                umask = process_umask()
+                mode = None if umask is None else 0o666 & ~umask
+            if mode is not None:
+                os.fchmod(fd, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
 # 初始化用户系统
 
+@st.cache_resource(show_spinner=False)
 def init_chat_db():
-    """初始化聊天记录文件"""
-    if not os.path.exists(CHAT_DB):
-        with open(CHAT_DB, "w", encoding="utf-8") as f:
-            json.dump({}, f, ensure_ascii=False)
+    """初始化聊天记录目录，并迁移旧版单文件聊天记录
+
+    放在资源缓存中，每个进程只执行一次（模块级标志会在每次重运行时重置）。
+    """
+    if not os.path.isdir(CHAT_DIR):
+        os.makedirs(CHAT_DIR, exist_ok=True)
+
+        if os.path.exists(LEGACY_CHAT_DB):
+            try:
+                with open(LEGACY_CHAT_DB, "rb") as f:
+                    all_chats = orjson.loads(f.read())
+            except:
+                all_chats = {}
+            for chat_id, messages in all_chats.items():
+                write_chat_file(chat_file_path(chat_id), messages)
+
+
 def load_users():
-    """加载用户数据"""
+    """加载用户数据（文件未变化时直接返回缓存）
+
+    返回的字典存放在file_caches的资源缓存中，跨重运行保留并由所有会话共享，只能读取；
+    需要修改时使用 load_users_for_update。
+    """
+    stamp = file_stamp(USERS_FILE)
+    entry = _users_cache["entry"]
+    if stamp is not None and entry is not None and stamp == entry[0]:
+        return entry[1]
+
     try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
+        with open(USERS_FILE, 'rb') as f:
+            raw = f.read()
+        users = orjson.loads(raw)
     except:
         return {}
 
+    _users_cache["entry"] = (stamp, users, raw)
+    return users
+
+
+def load_users_for_update():
+    """加载用户数据的可修改副本（修改后通过save_users整体替换共享缓存）"""
+    return copy.deepcopy(load_users())
+
 
 def save_users(users):
-    """保存用户数据"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f)
+    """保存用户数据（内容与磁盘一致时跳过写入；写入成功后传入的字典成为共享缓存，调用方不应再修改）"""
+    data = orjson.dumps(users, option=USERS_DUMP_OPTS)
+    entry = _users_cache["entry"]
+    if entry is not None and data == entry[2] and file_stamp(USERS_FILE) == entry[0]:
+        _users_cache["entry"] = (entry[0], users, data)
+        return
+
+    atomic_write(USERS_FILE, data)
+
+    _users_cache["entry"] = (file_stamp(USERS_FILE), users, data)
+
+
+def lookup_user(username):
+    """查找单个用户记录（缓存有效时直接读取；用户文件被其他进程改写、缓存失效时流式解析到该用户即停止）"""
+    stamp = file_stamp(USERS_FILE)
+    entry = _users_cache["entry"]
+    if stamp is not None and entry is not None and stamp == entry[0]:
+        # 返回副本，避免调用方（如会话状态）修改共享缓存
+        return copy.deepcopy(entry[1].get(username))
+
+    try:
+        with open(USERS_FILE, 'rb') as f:
+            for key, value in ijson.kvitems(f, '', use_float=True):
+                if key == username:
+                    return value
+    except (OSError, ijson.JSONError):
+        return None
+    return None
+
+
+def build_user_index(users):
+    """构建用户名元组和用户类型字典"""
+    return tuple(users), {username: info.get('user_type') for username, info in users.items()}
+
+
+def load_user_index():
+    """获取用户名和用户类型索引（随用户缓存失效而重建）"""
+    users = load_users()
+    entry = _users_cache["entry"]
+    if entry is None or users is not entry[1]:
+        return build_user_index(users)
+    # 索引与构建它的用户字典一起缓存，其他会话替换用户数据后不会误用旧索引
+    cached = _users_cache["index"]
+    if cached is None or cached[0] is not users:
+        cached = (users, build_user_index(users))
+        _users_cache["index"] = cached
+    return cached[1]
+
+
+def password_digest(password) -> bytes:
+    """计算密码的SHA-256原始摘要"""
+    return hashlib.sha256(password.encode()).digest()
 
 
 def hash_password(password):
-    """密码哈希处理"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """密码哈希处理（摘要以base64文本存储）"""
+    return base64.b64encode(password_digest(password)).decode('ascii')
+
+
+def stored_password_digest(stored_hash) -> bytes:
+    """还原存储的密码摘要，兼容旧版十六进制格式"""
+    try:
+        if len(stored_hash) == 64:
+            return bytes.fromhex(stored_hash)
+        return base64.b64decode(stored_hash, validate=True)
+    except (TypeError, ValueError):
+        return b""
 
 
 def register_user(username, password, user_type="普通用户", farm_info=None):
     """注册新用户"""
-    users = load_users()
+    users = load_users_for_update()
 
     if username in users:
         return False, "用户名已存在"
@@ -88,16 +299,19 @@ def register_user(username, password, user_type="普通用户", farm_info=None):
 
 def verify_user(username, password):
     """验证用户登录"""
-    users = load_users()
+    user_data = lookup_user(username)
 
-    if username in users and users[username]['password'] == hash_password(password):
-        user_data = users[username]
+    # 常量时间比较摘要，避免时序侧信道
+    if user_data is not None and hmac.compare_digest(stored_password_digest(user_data['password']),
+                                                     password_digest(password)):
         if 'user_data' not in user_data:
-            user_data['user_data'] = {
+            users = load_users_for_update()
+            users[username]['user_data'] = {
                 'planting_data': None,
                 'benefit_data': None
             }
             save_users(users)
+            user_data = lookup_user(username)
         return True, user_data
     return False, None
 
@@ -112,26 +326,101 @@ def verify_user(username, password):
 # ------------------------------
 
 
+def chat_file_path(chat_id: str) -> str:
+    """获取聊天记录文件路径（聊天ID编码为安全文件名）"""
+    return os.path.join(CHAT_DIR, quote(chat_id, safe="") + ".jsonl")
+
+
+def write_chat_file(path: str, messages: list) -> None:
+    """整体重写聊天记录文件"""
+    atomic_write(path, b"".join(orjson.dumps(m) + b"\n" for m in messages))
+
+    _chat_cache[path] = (file_stamp(path), messages)
+
+
+def read_chat_file(path: str) -> list:
+    """读取聊天记录文件，超出上限时顺带压缩文件"""
+    stamp = file_stamp(path)
+    if stamp is None:
+        return []
+
+    cached = _chat_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    try:
+        with open(path, "rb") as f:
+            lines = [line for line in f if line.strip()]
+    except OSError:
+        return []
+
+    messages = []
+    for line in lines:
+        try:
+            messages.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            # 跳过写入中断产生的残缺行
+            continue
+
+    # 限制聊天记录长度，避免文件过大（在读取时惰性压缩，而不是每次写入）
+    if len(messages) > CHAT_HISTORY_LIMIT:
+        messages = messages[-CHAT_HISTORY_KEEP:]
+        write_chat_file(path, messages)
+    else:
+        _chat_cache[path] = (stamp, messages)
+
+    return messages
+
+
 def load_chat_history(chat_id: str) -> list:
     """加载聊天记录 - 支持公共频道和私聊"""
     init_chat_db()
+    return read_chat_file(chat_file_path(chat_id))
+
+
+def load_chat_tail(chat_id: str, n: int = CHAT_DISPLAY_SIZE) -> list:
+    """加载最近n条聊天记录，只解析文件末尾的n行"""
+    init_chat_db()
+    path = chat_file_path(chat_id)
+
+    cached = _chat_cache.get(path)
+    if cached is not None and cached[0] == file_stamp(path):
+        return cached[1][-n:]
+
     try:
-        with open(CHAT_DB, "r", encoding="utf-8") as f:
-            all_chats = json.load(f)
-    except:
-        all_chats = {}
+        with open(path, "rb") as f:
+            lines = deque((line for line in f if line.strip()), maxlen=n)
+    except OSError:
+        return []
 
-    return all_chats.get(chat_id, [])
+    messages = []
+    for line in lines:
+        try:
+            messages.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            continue
+    return messages
 
 
-def save_message(chat_id: str, sender: str, content: str, message_type: str = "text") -> None:
-    """保存消息到聊天记录"""
+def count_chat_messages(chat_id: str) -> int:
+    """统计聊天记录条数（只数行，不解析）"""
     init_chat_db()
+    path = chat_file_path(chat_id)
+
+    cached = _chat_cache.get(path)
+    if cached is not None and cached[0] == file_stamp(path):
+        return len(cached[1])
+
     try:
-        with open(CHAT_DB, "r", encoding="utf-8") as f:
-            all_chats = json.load(f)
-    except:
-        all_chats = {}
+        with open(path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    except OSError:
+        return 0
+
+
+def save_message(chat_id: str, sender: str, content: str, message_type: str = "text") -> None:
+    """保存消息到聊天记录（追加一行，无需重写整个文件）"""
+    init_chat_db()
 
     message = {
         "sender": sender,
@@ -141,61 +430,57 @@ def save_message(chat_id: str, sender: str, content: str, message_type: str = "t
         "read": False  # 新增：消息是否已读
     }
 
-    if chat_id not in all_chats:
-        all_chats[chat_id] = []
-
-    all_chats[chat_id].append(message)
-
-    # 限制聊天记录长度，避免文件过大
-    if len(all_chats[chat_id]) > 1000:
-        all_chats[chat_id] = all_chats[chat_id][-500:]
-
-    with open(CHAT_DB, "w", encoding="utf-8") as f:
-        json.dump(all_chats, f, ensure_ascii=False, indent=2)
+    with open(chat_file_path(chat_id), "ab") as f:
+        f.write(orjson.dumps(message) + b"\n")
 
 
 def mark_messages_as_read(chat_id: str, reader: str):
     """标记消息为已读"""
     init_chat_db()
-    try:
-        with open(CHAT_DB, "r", encoding="utf-8") as f:
-            all_chats = json.load(f)
-    except:
+    path = chat_file_path(chat_id)
+    if not os.path.exists(path):
         return
 
-    if chat_id in all_chats:
-        for message in all_chats[chat_id]:
-            if message["sender"] != reader:
-                message["read"] = True
+    # 缓存的消息列表由所有会话共享，已读标记写在副本上
+    changed = False
+    messages = []
+    for message in read_chat_file(path):
+        if message["sender"] != reader and not message.get("read", False):
+            message = dict(message, read=True)
+            changed = True
+        messages.append(message)
+
+    # 没有新的已读标记时不重写文件
+    if changed:
+        write_chat_file(path, messages)
 
-        with open(CHAT_DB, "w", encoding="utf-8") as f:
-            json.dump(all_chats, f, ensure_ascii=False, indent=2)
+
+def count_unread(messages: list, username: str) -> int:
+    """统计已加载消息中的未读数量"""
+    return sum(1 for msg in messages if msg["sender"] != username and not msg.get("read", False))
 
 
 def get_unread_count(chat_id: str, username: str) -> int:
     """获取未读消息数量"""
-    chat_history = load_chat_history(chat_id)
-    unread_count = 0
-    for msg in chat_history:
-        if msg["sender"] != username and not msg.get("read", False):
-            unread_count += 1
-    return unread_count
+    return count_unread(load_chat_history(chat_id), username)
 
 
 def get_recent_chats(username: str) -> List[Dict]:
     """获取用户最近参与的聊天"""
     init_chat_db()
     try:
-        with open(CHAT_DB, "r", encoding="utf-8") as f:
-            all_chats = json.load(f)
-    except:
+        file_names = os.listdir(CHAT_DIR)
+    except OSError:
         return []
 
     recent_chats = []
-    for chat_id in all_chats.keys():
+    for file_name in file_names:
+        if not file_name.endswith(".jsonl"):
+            continue
+        chat_id = unquote(file_name[:-len(".jsonl")])
         if username in chat_id.split("|") or chat_id == "PUBLIC_CHANNEL":
             # 获取最后一条消息
-            messages = all_chats[chat_id]
+            messages = read_chat_file(os.path.join(CHAT_DIR, file_name))
             if messages:
                 last_msg = messages[-1]
                 # 确定聊天名称
@@ -207,7 +492,7 @@ def get_recent_chats(username: str) -> List[Dict]:
                     chat_name = f"与 {other_user} 的私聊"
                     chat_type = "private"
 
-                unread_count = get_unread_count(chat_id, username)
+                unread_count = count_unread(messages, username)
 
                 recent_chats.append({
                     "chat_id": chat_id,
@@ -223,12 +508,45 @@ def get_recent_chats(username: str) -> List[Dict]:
     return recent_chats[:10]  # 返回最近10个聊天
 
 
+# 聊天消息样式：自己的消息靠右，他人的消息靠左
+CHAT_STYLE = """<style>
+.chat-msg{display:flex;align-items:flex-start;gap:8px;margin:8px 0;}
+.chat-msg.own{flex-direction:row-reverse;}
+.chat-avatar{font-size:1.4rem;line-height:1.6rem;}
+.chat-bubble{max-width:75%;padding:8px 12px;border-radius:10px;background:#f0f2f6;}
+.chat-msg.own .chat-bubble{background:#e6f4ea;}
+.chat-meta{font-size:0.8rem;color:#718096;margin-bottom:4px;}
+.chat-text{word-break:break-word;}
+</style>"""
+
+
+def render_chat_messages(chat_history: list, current_user: str) -> None:
+    """将聊天记录拼接为一段HTML，一次性渲染"""
+    blocks = [CHAT_STYLE]
+    for msg in chat_history:
+        is_own_message = msg['sender'] == current_user
+        row_class = "chat-msg own" if is_own_message else "chat-msg"
+        avatar = "👤" if is_own_message else "👥"
+        sender = html.escape(msg['sender'])
+        # 换行转为<br>，避免空行截断HTML块
+        content = html.escape(msg['content']).replace("\n", "<br>")
+        blocks.append(
+            f'<div class="{row_class}"><div class="chat-avatar">{avatar}</div>'
+            f'<div class="chat-bubble"><div class="chat-meta"><b>{sender}</b> · {msg["time"]}</div>'
+            f'<div class="chat-text">{content}</div></div></div>'
+        )
+    st.markdown("".join(blocks), unsafe_allow_html=True)
+
+
 def chat_page():
     """优化的聊天咨询页面"""
     st.header("💬 农业交流中心")
     current_user = st.session_state.username
     user_type = st.session_state.user_data['user_type']
 
+    # 记录在线状态
+    record_presence(current_user)
+
     # 聊天模式选择
     col_mode, col_info = st.columns([2, 1])
     with col_mode:
@@ -267,28 +585,14 @@ def public_chat_page(current_user: str, user_type: str):
         chat_container = st.container(height=500, border=True)
 
         with chat_container:
-            # 加载聊天记录
-            chat_history = load_chat_history(public_chat_id)
+            # 加载最近的聊天记录
+            chat_history = load_chat_tail(public_chat_id)
 
             if not chat_history:
                 st.info("💬 欢迎来到公共频道！这里是所有用户交流种植经验、咨询问题的平台。")
 
-            # 显示消息 - 使用Streamlit原生方式
-            for msg in chat_history:
-                is_own_message = msg['sender'] == current_user
-
-                if is_own_message:
-                    # 自己发送的消息 - 右侧显示
-                    with st.chat_message("user", avatar="👤"):
-                        st.write(f"**{msg['sender']}**")
-                        st.caption(f"{msg['time']}")
-                        st.write(msg['content'])
-                else:
-                    # 他人发送的消息 - 左侧显示
-                    with st.chat_message("assistant", avatar="👥"):
-                        st.write(f"**{msg['sender']}**")
-                        st.caption(f"{msg['time']}")
-                        st.write(msg['content'])
+            # 显示消息 - 拼接后一次渲染
+            render_chat_messages(chat_history, current_user)
 
         # 消息输入区域
         with st.form(key="public_chat_form", clear_on_submit=True):
@@ -334,15 +638,17 @@ def public_chat_page(current_user: str, user_type: str):
     with col_side:
         st.subheader("📊 频道统计")
 
-        # 在线用户统计
-        users = load_users()
-        registered_users = [uname for uname in users.keys() if uname != current_user]
-        online_users_count = len([u for u in registered_users if random.random() > 0.3]) + 1
+        # 在线用户统计：最近一段时间内访问过聊天页面的用户
+        online_users_count = count_online_users()
 
         st.metric("在线用户", f"{online_users_count}人")
-        st.metric("今日消息",
-                  f"{len([m for m in chat_history if m['time'].startswith(datetime.now().strftime('%Y-%m-%d'))])}条")
-        st.metric("总消息数", f"{len(chat_history)}条")
+        # 消息按时间追加，今日消息位于末尾；若最近记录全是今日消息则可能还有更早的
+        today = datetime.now().strftime('%Y-%m-%d')
+        total_messages = count_chat_messages(public_chat_id)
+        today_messages = sum(1 for m in chat_history if m['time'].startswith(today))
+        today_more = "+" if today_messages == len(chat_history) < total_messages else ""
+        st.metric("今日消息", f"{today_messages}{today_more}条")
+        st.metric("总消息数", f"{total_messages}条")
 
         st.divider()
 
@@ -370,8 +676,8 @@ def private_chat_page(current_user: str, user_type: str):
     st.subheader("🔒 私聊")
 
     # 获取用户列表（排除自己）
-    users = load_users()
-    other_users = [username for username in users.keys() if username != current_user]
+    usernames, user_types = load_user_index()
+    other_users = [username for username in usernames if username != current_user]
 
     col_users, col_chat = st.columns([1, 2])
 
@@ -398,8 +704,8 @@ def private_chat_page(current_user: str, user_type: str):
         # 所有用户列表
         st.write("**所有用户**")
         for username in other_users:
-            user_type_icon = "👨‍🌾" if users[username]['user_type'] == "农场主" else "👨‍💼" if users[username][
-                                                                                                 'user_type'] == "管理员" else "👤"
+            other_type = user_types[username]
+            user_type_icon = "👨‍🌾" if other_type == "农场主" else "👨‍💼" if other_type == "管理员" else "👤"
             if st.button(
                     f"{user_type_icon} {username}",
                     key=f"user_{username}",
@@ -428,27 +734,13 @@ def private_chat_page(current_user: str, user_type: str):
         chat_container = st.container(height=400, border=True)
 
         with chat_container:
-            chat_history = load_chat_history(selected_chat_id)
+            chat_history = load_chat_tail(selected_chat_id)
 
             if not chat_history:
                 st.info(f"💬 开始与 {other_user} 的对话")
 
-            # 显示消息 - 使用Streamlit原生方式
-            for msg in chat_history:
-                is_own_message = msg['sender'] == current_user
-
-                if is_own_message:
-                    # 自己发送的消息 - 右侧显示
-                    with st.chat_message("user", avatar="👤"):
-                        st.write(f"**{msg['sender']}**")
-                        st.caption(f"{msg['time']}")
-                        st.write(msg['content'])
-                else:
-                    # 他人发送的消息 - 左侧显示
-                    with st.chat_message("assistant", avatar="👥"):
-                        st.write(f"**{msg['sender']}**")
-                        st.caption(f"{msg['time']}")
-                        st.write(msg['content'])
+            # 显示消息 - 拼接后一次渲染
+            render_chat_messages(chat_history, current_user)
 
         # 消息输入区域
         with st.form(key="private_chat_form", clear_on_submit=True):
@@ -486,35 +778,84 @@ def private_chat_page(current_user: str, user_type: str):
 # 将原来的 chat_page() 调用替换为新的优化版本
 def update_user_preferences(username, preferences):
     """更新用户偏好设置"""
-    users = load_users()
-    if username in users:
-        users[username]['preferences'] = preferences
+    user = lookup_user(username)
+    if user is None:
+        return False
+    # 与已保存的偏好相同时无需重写用户文件
+    if user.get('preferences') != preferences:
+        users = load_users_for_update()
+        users[username]['preferences'] = dict(preferences)
         save_users(users)
-        return True
-    return False
+    return True
 
 
 def get_user_preferences(username):
     """获取用户偏好设置"""
-    users = load_users()
-    if username in users:
-        return users[username]['preferences']
+    user = lookup_user(username)
+    if user is not None:
+        return user['preferences']
     return None
 
 
+def user_data_path(username, data_type):
+    """用户数据文件路径（用户名经URL编码，避免特殊字符）"""
+    return os.path.join(USER_DATA_DIR, f"{quote(username, safe='')}.{data_type}.mpk")
+
+
+def msgpack_default(obj):
+    """msgpack不能直接处理的numpy数值和日期转为Python原生类型"""
+    # 缺失的日期（NaT也是datetime的实例，需先判断）保存为空值
+    if obj is pd.NaT or (isinstance(obj, np.datetime64) and np.isnat(obj)):
+        return None
+    # pyarrow解析CSV时会推断出日期列，日期统一保存为ISO格式字符串
+    if isinstance(obj, np.datetime64):
+        return pd.Timestamp(obj).isoformat()
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def write_user_data_file(path, records):
+    """以msgpack格式写入用户数据记录"""
+    data = msgpack.packb(records, use_bin_type=True, default=msgpack_default)
+    os.makedirs(USER_DATA_DIR, exist_ok=True)
+    atomic_write(path, data)
+    # 缓存序列化后的结果（日期为ISO字符串、NaT为None），与从磁盘读回的记录一致
+    _user_data_cache[path] = (file_stamp(path), msgpack.unpackb(data, raw=False))
+
+
+def read_user_data_file(path):
+    """读取用户数据记录，文件未变化时直接复用进程内缓存；文件不存在时返回None"""
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+
+    cached = _user_data_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        records = msgpack.unpackb(f.read(), raw=False)
+    _user_data_cache[path] = (stamp, records)
+    return records
+
+
 def save_user_data(username, data_type, data):
     """保存用户数据"""
-    users = load_users()
-    if username in users:
-        if 'user_data' not in users[username]:
-            users[username]['user_data'] = {
-                'planting_data': None,
-                'benefit_data': None
-            }
-        users[username]['user_data'][data_type] = data
+    user = lookup_user(username)
+    if user is None:
+        return False
+
+    write_user_data_file(user_data_path(username, data_type), data)
+
+    # 旧版本把数据直接存在用户文件中，保存新数据后清掉旧副本
+    if (user.get('user_data') or {}).get(data_type) is not None:
+        users = load_users_for_update()
+        users[username]['user_data'][data_type] = None
         save_users(users)
-        return True
-    return False
+    return True
 
 # 预定义的初始账号（包含5个管理员账号）
 PREDEFINED_ACCOUNTS = {
@@ -635,17 +976,20 @@ REDEMPTION_CODES = {
 }
 def get_user_data(username, data_type):
     """获取用户数据"""
-    users = load_users()
-    if username in users:
-        if 'user_data' not in users[username]:
-            users[username]['user_data'] = {
-                'planting_data': None,
-                'benefit_data': None
-            }
-            save_users(users)
-            return None
-        return users[username]['user_data'].get(data_type)
-    return None
+    user = lookup_user(username)
+    if user is None:
+        return None
+
+    path = user_data_path(username, data_type)
+    records = read_user_data_file(path)
+    if records is not None:
+        return records
+
+    # 迁移旧数据：首次读取时把用户文件中内嵌的记录转存为独立的msgpack文件
+    records = (user.get('user_data') or {}).get(data_type)
+    if records is not None:
+        save_user_data(username, data_type, records)
+    return records
 
 
 # 核心算法实现
@@ -664,101 +1008,99 @@ class AgriculturalOptimizer:
             "极度积极": 0.9
         }
 
+        # 预先计算评分所需的列最大值和豆类标记，避免逐行重复计算
+        self._max_benefit = benefit_data['亩效益/元'].max()
+        self._max_cost = benefit_data['种植成本/(元/亩)'].max()
+        self._max_yield = benefit_data['亩产量/斤'].max()
+        self._is_bean = benefit_data['作物名称'].str.contains('豆', regex=False, na=False).to_numpy()
+        # 按作物名称索引的效益记录（同名作物取第一条），替代逐次布尔筛选
+        self._by_crop = benefit_data.drop_duplicates('作物名称').set_index('作物名称').to_dict('index')
+
+        # 规划求解所需的作物列表和当前种植面积，只在构造时计算一次
+        self._crops = list(self._by_crop)
+        self._crop_index = {crop: i for i, crop in enumerate(self._crops)}
+        self._bean_mask = np.array(['豆' in crop for crop in self._crops], dtype=bool)
+        self._bean_crops = [crop for crop, is_bean in zip(self._crops, self._bean_mask) if is_bean]
+        self._current_planting = planting_data.groupby('作物名称')['种植面积/亩'].sum().to_dict()
+
     def calculate_crop_suitability(self) -> Dict[str, float]:
         """计算作物适应性评分"""
-        suitability_scores = {}
+        benefit = self.benefit_data['亩效益/元'].to_numpy(dtype=float)
+        cost = self.benefit_data['种植成本/(元/亩)'].to_numpy(dtype=float)
+        crop_yield = self.benefit_data['亩产量/斤'].to_numpy(dtype=float)
 
-        for _, crop in self.benefit_data.iterrows():
-            score = 0.0
+        # 经济效益评分 (40%)
+        economic_score = benefit / self._max_benefit
 
-            # 经济效益评分 (40%)
-            economic_score = crop['亩效益/元'] / self.benefit_data['亩效益/元'].max()
-            score += economic_score * 0.4
+        # 稳定性评分 (30%)
+        cost_stability = 1 - cost / self._max_cost
+        yield_stability = crop_yield / self._max_yield
+        stability_score = (cost_stability + yield_stability) / 2
 
-            # 稳定性评分 (30%)
-            cost_stability = 1 - (crop['种植成本/(元/亩)'] / self.benefit_data['种植成本/(元/亩)'].max())
-            yield_stability = crop['亩产量/斤'] / self.benefit_data['亩产量/斤'].max()
-            stability_score = (cost_stability + yield_stability) / 2
-            score += stability_score * 0.3
+        # 可持续性评分 (30%)
+        # 豆类作物有轮作优势，低成本作物更可持续
+        sustainability_bonus = np.where(self._is_bean, 0.3, 0.1)
+        sustainability_score = (sustainability_bonus + cost_stability) / 2
 
-            # 可持续性评分 (30%)
-            # 豆类作物有轮作优势
-            if '豆' in crop['作物名称']:
-                sustainability_bonus = 0.3
-            else:
-                sustainability_bonus = 0.1
-
-            # 低成本作物更可持续
-            cost_sustainability = 1 - (crop['种植成本/(元/亩)'] / self.benefit_data['种植成本/(元/亩)'].max())
-            sustainability_score = (sustainability_bonus + cost_sustainability) / 2
-            score += sustainability_score * 0.3
+        scores = economic_score * 0.4 + stability_score * 0.3 + sustainability_score * 0.3
 
-            suitability_scores[crop['作物名称']] = score
+        return dict(zip(self.benefit_data['作物名称'], scores.tolist()))
 
-        return suitability_scores
+    def optimize_planting_plan(self, total_area: float, years: int = 3,
+                               suitability_scores: Dict[str, float] = None) -> Dict:
+        """优化种植规划 - 使用线性规划（可传入已计算好的适应性评分）"""
+        from scipy.optimize import linprog
 
-    def optimize_planting_plan(self, total_area: float, years: int = 3) -> Dict:
-        """优化种植规划 - 使用线性规划"""
         try:
             # 准备数据
-            crops = self.benefit_data['作物名称'].tolist()
-            current_planting = self.planting_data.groupby('作物名称')['种植面积/亩'].sum().to_dict()
-
-            # 创建问题实例
-            prob = pulp.LpProblem("Agricultural_Optimization", pulp.LpMaximize)
-
-            # 决策变量：各种作物的种植面积
-            crop_areas = pulp.LpVariable.dicts("CropArea", crops, lowBound=0)
+            crops = self._crops
+            current_planting = self._current_planting
 
             # 目标函数：最大化综合效益
-            suitability_scores = self.calculate_crop_suitability()
+            if suitability_scores is None:
+                suitability_scores = self.calculate_crop_suitability()
             risk_factor = self.risk_levels.get(self.preferences['risk_level'], 0.5)
 
-            # 计算加权目标函数
-            objective = 0
-            for crop in crops:
-                crop_data = self.benefit_data[self.benefit_data['作物名称'] == crop].iloc[0]
+            benefit = np.array([self._by_crop[crop]['亩效益/元'] for crop in crops], dtype=float)
+            cost = np.array([self._by_crop[crop]['种植成本/(元/亩)'] for crop in crops], dtype=float)
+            suitability = np.array([suitability_scores[crop] for crop in crops], dtype=float)
 
-                # 经济效益部分
-                economic_value = crop_data['亩效益/元'] * self.preferences['economic_weight']
-
-                # 稳定性部分（考虑风险偏好）
-                stability_value = (1 - crop_data['种植成本/(元/亩)'] / 2000) * self.preferences['stability_weight']
-
-                # 可持续性部分
-                sustainability_value = suitability_scores[crop] * self.preferences['sustainability_weight']
-
-                # 综合价值
-                crop_value = (economic_value + stability_value + sustainability_value) * risk_factor
-
-                objective += crop_value * crop_areas[crop]
-
-            prob += objective
+            # 计算加权目标函数：经济效益 + 稳定性（考虑风险偏好）+ 可持续性
+            economic_value = benefit * self.preferences['economic_weight']
+            stability_value = (1 - cost / 2000) * self.preferences['stability_weight']
+            sustainability_value = suitability * self.preferences['sustainability_weight']
+            crop_value = (economic_value + stability_value + sustainability_value) * risk_factor
 
             # 约束条件
             # 总面积约束
-            prob += pulp.lpSum([crop_areas[crop] for crop in crops]) <= total_area
+            A_ub = [np.ones(len(crops))]
+            b_ub = [total_area]
 
             # 轮作约束：豆类作物最小面积（改善土壤）
-            bean_crops = [crop for crop in crops if '豆' in crop]
-            if bean_crops:
+            if self._bean_crops:
                 min_bean_area = total_area * 0.15  # 至少15%的面积种植豆类
-                prob += pulp.lpSum([crop_areas[crop] for crop in bean_crops]) >= min_bean_area
+                A_ub.append(-self._bean_mask.astype(float))
+                b_ub.append(-min_bean_area)
 
             # 多样性约束：单一作物不超过总面积的30%
-            for crop in crops:
-                prob += crop_areas[crop] <= total_area * 0.3
+            lower = np.zeros(len(crops))
+            upper = np.full(len(crops), total_area * 0.3)
 
             # 连续性约束：当前种植的作物面积变化不超过50%
             for crop, current_area in current_planting.items():
-                if crop in crop_areas:
-                    prob += crop_areas[crop] >= current_area * 0.5
-                    prob += crop_areas[crop] <= current_area * 1.5
+                i = self._crop_index.get(crop)
+                if i is not None:
+                    lower[i] = max(lower[i], current_area * 0.5)
+                    upper[i] = min(upper[i], current_area * 1.5)
 
-            # 求解
-            prob.solve(pulp.PULP_CBC_CMD(msg=0))
+            if np.any(lower > upper):
+                return {'status': 'infeasible', 'message': '无法找到可行解'}
+
+            # 求解（HiGHS 在进程内求解，线性规划求最小值，目标取负）
+            res = linprog(-crop_value, A_ub=np.array(A_ub), b_ub=b_ub,
+                          bounds=list(zip(lower, upper)), method='highs')
 
-            if pulp.LpStatus[prob.status] == 'Optimal':
+            if res.status == 0:
                 result = {
                     'status': 'optimal',
                     'total_area': total_area,
@@ -770,10 +1112,9 @@ class AgriculturalOptimizer:
                 current_total_benefit = 0
                 new_total_benefit = 0
 
-                for crop in crops:
-                    area = crop_areas[crop].varValue
-                    if area > 0:
-                        crop_data = self.benefit_data[self.benefit_data['作物名称'] == crop].iloc[0]
+                for crop, area in zip(crops, res.x.tolist()):
+                    if area > 1e-9:
+                        crop_data = self._by_crop[crop]
                         result['crop_allocations'][crop] = {
                             'area': area,
                             'expected_benefit': crop_data['亩效益/元'] * area,
@@ -804,7 +1145,7 @@ class AgriculturalOptimizer:
         total_expected_return = 0
 
         for crop, allocation in crop_allocations.items():
-            crop_data = self.benefit_data[self.benefit_data['作物名称'] == crop].iloc[0]
+            crop_data = self._by_crop[crop]
 
             investment = crop_data['种植成本/(元/亩)'] * allocation['area']
             expected_return = crop_data['亩效益/元'] * allocation['area']
@@ -814,7 +1155,7 @@ class AgriculturalOptimizer:
 
             # 风险评分基于成本波动性和产量稳定性
             cost_risk = crop_data['种植成本/(元/亩)'] / 1000  # 标准化
-            yield_risk = 1 - (crop_data['亩产量/斤'] / self.benefit_data['亩产量/斤'].max())
+            yield_risk = 1 - (crop_data['亩产量/斤'] / self._max_yield)
 
             risk_score = (cost_risk + yield_risk) / 2
             risk_scores[crop] = {
@@ -836,51 +1177,61 @@ class AgriculturalOptimizer:
         }
 
 
+@st.cache_resource(max_entries=32, ttl=3600, show_spinner=False)
+def get_optimizer(planting_data, benefit_data, preferences):
+    """获取优化器实例（相同数据和偏好跨重运行复用同一实例，构建后只读；限制条目数和存活时间）"""
+    return AgriculturalOptimizer(planting_data, benefit_data, dict(preferences))
+
+
+@st.cache_data(show_spinner=False)
+def cached_crop_suitability(planting_data, benefit_data):
+    """计算作物适应性评分（评分与偏好无关，只按数据跨重运行复用结果）"""
+    return AgriculturalOptimizer(planting_data, benefit_data, {}).calculate_crop_suitability()
+
+
 class PricePredictor:
     """价格预测算法类"""
 
     def __init__(self, historical_data=None):
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.scaler = StandardScaler()
+        self.model = None
         self.is_trained = False
 
-    def create_synthetic_data(self, benefit_data):
-        """创建合成历史数据用于演示"""
+    @staticmethod
+    @st.cache_data(ttl=24 * 3600, show_spinner=False)
+    def create_synthetic_data(benefit_data):
+        """创建合成历史数据用于演示（按效益数据缓存一天）"""
         dates = pd.date_range(start='2020-01-01', end='2024-01-01', freq='M')
-        synthetic_data = []
-
-        for crop in benefit_data['作物名称'].unique():
-            crop_data = benefit_data[benefit_data['作物名称'] == crop].iloc[0]
-            base_price = crop_data['销售单价/(元/斤)']
-
-            for date in dates:
-                # 添加季节性和随机波动
-                seasonal_factor = 1 + 0.2 * np.sin(2 * np.pi * date.month / 12)
-                random_factor = 1 + np.random.normal(0, 0.1)
-                price = base_price * seasonal_factor * random_factor
-
-                synthetic_data.append({
-                    'date': date,
-                    'crop': crop,
-                    'price': max(price, base_price * 0.5),  # 确保价格不会太低
-                    'month': date.month,
-                    'year': date.year
-                })
-
-        return pd.DataFrame(synthetic_data)
+        months = dates.month.to_numpy()
+        years = dates.year.to_numpy()
+
+        # 每种作物取第一条记录的销售单价，形状 (作物数, 1) 以便按月份广播
+        crop_rows = benefit_data.drop_duplicates('作物名称')
+        crops = crop_rows['作物名称'].to_numpy()
+        base_prices = crop_rows['销售单价/(元/斤)'].to_numpy(dtype=float)[:, np.newaxis]
+
+        # 添加季节性和随机波动
+        seasonal_factor = 1 + 0.2 * np.sin(2 * np.pi * months / 12)
+        random_factor = 1 + np.random.normal(0, 0.1, (len(crops), len(dates)))
+        prices = np.maximum(base_prices * seasonal_factor * random_factor, base_prices * 0.5)  # 确保价格不会太低
+
+        return pd.DataFrame({
+            'date': np.tile(dates.to_numpy(), len(crops)),
+            'crop': np.repeat(crops, len(dates)),
+            'price': prices.ravel(),
+            'month': np.tile(months, len(crops)),
+            'year': np.tile(years, len(crops))
+        })
 
     def train(self, benefit_data):
         """训练预测模型"""
+        from sklearn.ensemble import HistGradientBoostingRegressor
+
         try:
             historical_data = self.create_synthetic_data(benefit_data)
 
-            # 特征工程
-            features = historical_data[['month', 'year']]
-            target = historical_data['price']
-
-            # 训练模型
-            features_scaled = self.scaler.fit_transform(features)
-            self.model.fit(features_scaled, target)
+            # 训练模型（树模型不需要特征标准化）
+            self.model = HistGradientBoostingRegressor(max_iter=100, max_depth=6, random_state=42)
+            self.model.fit(historical_data[['month', 'year']].to_numpy(), historical_data['price'].to_numpy())
             self.is_trained = True
 
             return True
@@ -894,25 +1245,31 @@ class PricePredictor:
             return None
 
         future_dates = pd.date_range(start=datetime.now(), periods=months, freq='M')
-        predictions = []
 
-        for date in future_dates:
-            features = np.array([[date.month, date.year]])
-            features_scaled = self.scaler.transform(features)
-            predicted_price = self.model.predict(features_scaled)[0]
-            predictions.append({
-                'date': date,
-                'predicted_price': max(predicted_price, 0.1)  # 确保价格为正
-            })
+        # 一次性对所有月份做预测
+        features = np.column_stack([future_dates.month.to_numpy(), future_dates.year.to_numpy()])
+        predicted_prices = np.maximum(self.model.predict(features), 0.1)  # 确保价格为正
+
+        return pd.DataFrame({
+            'date': future_dates,
+            'predicted_price': predicted_prices
+        })
+
 
-        return pd.DataFrame(predictions)
+@st.cache_resource(max_entries=8, ttl=3600, show_spinner=False)
+def get_trained_predictor(benefit_data):
+    """获取已训练的价格预测器（相同效益数据跨重运行复用，限制条目数和存活时间，训练失败时抛出异常以免缓存失败结果）"""
+    predictor = PricePredictor()
+    if not predictor.train(benefit_data):
+        raise RuntimeError("价格预测模型训练失败")
+    return predictor
 
 
 def redeem_account(redemption_code):
     """兑换账号"""
     if redemption_code in REDEMPTION_CODES:
         username = REDEMPTION_CODES[redemption_code]
-        users = load_users()
+        users = load_users_for_update()
 
         if username in users and users[username].get('is_predefined', False):
             if not users[username].get('redeemed', False):
@@ -934,21 +1291,28 @@ def init_users():
 
     # 如果users文件为空或不存在，将预定义账号添加进去
     if not users:
-        users = PREDEFINED_ACCOUNTS.copy()
-        save_users(users)
-    else:
-        # 确保所有预定义账号都在users中
-        for username, account_info in PREDEFINED_ACCOUNTS.items():
-            if username not in users:
-                users[username] = account_info
-            else:
-                # 保留预定义账号的属性，但更新其他可能修改的字段
-                users[username]['is_predefined'] = True
-                if 'redeemed' not in users[username]:
-                    users[username]['redeemed'] = account_info['redeemed']
-
+        users = copy.deepcopy(PREDEFINED_ACCOUNTS)
         save_users(users)
+        return users
+
+    # 预定义账号齐全且字段完整时无需修改，也不复制共享的用户数据
+    if all(username in users and users[username].get('is_predefined') is True
+           and 'redeemed' in users[username] for username in PREDEFINED_ACCOUNTS):
+        return users
+
+    # 确保所有预定义账号都在users中，在副本上修改后一次写回
+    users = load_users_for_update()
+    for username, account_info in PREDEFINED_ACCOUNTS.items():
+        user = users.get(username)
+        if user is None:
+            users[username] = copy.deepcopy(account_info)
+            continue
+        # 保留预定义账号的属性，但更新其他可能修改的字段
+        user['is_predefined'] = True
+        if 'redeemed' not in user:
+            user['redeemed'] = account_info['redeemed']
 
+    save_users(users)
     return users
 
 
@@ -1033,7 +1397,7 @@ def login_page():
                         # 自动登录
                         st.session_state.logged_in = True
                         st.session_state.username = temp_username
-                        st.session_state.user_data = load_users()[temp_username]
+                        st.session_state.user_data = lookup_user(temp_username)
                         st.rerun()
                     else:
                         st.error(message)
@@ -1087,7 +1451,9 @@ def user_profile_page():
                     'stability_weight': stability_weight,
                     'sustainability_weight': sustainability_weight
                 }
-                if update_user_preferences(st.session_state.username, preferences):
+                if preferences == st.session_state.user_data['preferences']:
+                    st.info("偏好设置未变更")
+                elif update_user_preferences(st.session_state.username, preferences):
                     st.session_state.user_data['preferences'] = preferences
                     st.success("偏好设置已保存！")
 
@@ -1102,6 +1468,8 @@ def user_profile_page():
 
 def admin_page():
     """管理员页面"""
+    import plotly.express as px
+
     if st.session_state.user_data['user_type'] != "管理员":
         st.error("无权限访问此页面")
         return
@@ -1131,6 +1499,15 @@ def admin_page():
     st.plotly_chart(fig, use_container_width=True)
 
 
+def read_uploaded_csv(uploaded_file):
+    """读取上传的CSV文件，优先使用pyarrow引擎，未安装时回退到默认引擎"""
+    try:
+        return pd.read_csv(uploaded_file, engine='pyarrow')
+    except ImportError:
+        uploaded_file.seek(0)
+        return pd.read_csv(uploaded_file)
+
+
 def data_management_page():
     """数据管理页面"""
     st.header("📁 数据管理")
@@ -1168,11 +1545,19 @@ def data_management_page():
 
         with col2:
             if st.button("保存种植数据", type="primary", use_container_width=True):
+                # 已确认的新记录在保存时一次性合并
+                pending = st.session_state.get('pending_planting_rows')
+                if pending:
+                    planting_df = pd.concat([planting_df, pd.DataFrame(pending)], ignore_index=True)
                 if save_user_data(st.session_state.username, 'planting_data', planting_df.to_dict('records')):
+                    st.session_state.pending_planting_rows = []
                     st.success("种植数据保存成功！")
                 else:
                     st.error("保存失败")
 
+        if st.session_state.get('pending_planting_rows'):
+            st.caption(f"已确认 {len(st.session_state.pending_planting_rows)} 条新记录，保存后生效")
+
         # 添加新记录的表单
         if 'new_planting_rows' in st.session_state:
             for i, row in enumerate(st.session_state.new_planting_rows):
@@ -1192,9 +1577,8 @@ def data_management_page():
                                                        ["单季", "双季", "多季"], key=f"season_{i}")
 
                     if st.button("确认添加", key=f"confirm_{i}"):
-                        new_row = pd.DataFrame([row])
-                        planting_df = pd.concat([planting_df, new_row], ignore_index=True)
-                        st.session_state.new_planting_rows.pop(i)
+                        st.session_state.setdefault('pending_planting_rows', []).append(
+                            st.session_state.new_planting_rows.pop(i))
                         st.rerun()
 
     with tab2:
@@ -1211,8 +1595,7 @@ def data_management_page():
             benefit_df = get_sample_benefit_data()
 
         # 计算亩效益
-        benefit_df['亩效益/元'] = benefit_df['亩产量/斤'] * benefit_df['销售单价/(元/斤)'] - benefit_df[
-            '种植成本/(元/亩)']
+        benefit_df = compute_benefit_df(benefit_df)
 
         # 显示数据
         st.dataframe(benefit_df, use_container_width=True)
@@ -1232,11 +1615,20 @@ def data_management_page():
 
         with col2:
             if st.button("保存效益数据", type="primary", use_container_width=True):
+                # 已确认的新记录在保存时一次性合并，并补算亩效益
+                pending = st.session_state.get('pending_benefit_rows')
+                if pending:
+                    benefit_df = compute_benefit_df(
+                        pd.concat([benefit_df, pd.DataFrame(pending)], ignore_index=True))
                 if save_user_data(st.session_state.username, 'benefit_data', benefit_df.to_dict('records')):
+                    st.session_state.pending_benefit_rows = []
                     st.success("效益数据保存成功！")
                 else:
                     st.error("保存失败")
 
+        if st.session_state.get('pending_benefit_rows'):
+            st.caption(f"已确认 {len(st.session_state.pending_benefit_rows)} 条新效益记录，保存后生效")
+
         # 添加新记录的表单
         if 'new_benefit_rows' in st.session_state:
             for i, row in enumerate(st.session_state.new_benefit_rows):
@@ -1258,9 +1650,8 @@ def data_management_page():
                                                        key=f"land_{i}")
 
                     if st.button("确认添加", key=f"bconfirm_{i}"):
-                        new_row = pd.DataFrame([row])
-                        benefit_df = pd.concat([benefit_df, new_row], ignore_index=True)
-                        st.session_state.new_benefit_rows.pop(i)
+                        st.session_state.setdefault('pending_benefit_rows', []).append(
+                            st.session_state.new_benefit_rows.pop(i))
                         st.rerun()
 
     with tab3:
@@ -1270,11 +1661,9 @@ def data_management_page():
 
         with col1:
             st.info("种植数据模板")
-            sample_planting = get_sample_planting_data()
-            csv_planting = sample_planting.to_csv(index=False).encode('utf-8')
             st.download_button(
                 label="下载种植数据模板",
-                data=csv_planting,
+                data=get_sample_csv('planting'),
                 file_name="种植数据模板.csv",
                 mime="text/csv",
                 use_container_width=True
@@ -1283,7 +1672,7 @@ def data_management_page():
             uploaded_planting = st.file_uploader("上传种植数据CSV", type=['csv'], key="planting_upload")
             if uploaded_planting is not None:
                 try:
-                    df_planting = pd.read_csv(uploaded_planting)
+                    df_planting = read_uploaded_csv(uploaded_planting)
                     required_cols = ['种植地块', '作物名称', '作物类型', '种植面积/亩', '种植季次']
                     if all(col in df_planting.columns for col in required_cols):
                         if save_user_data(st.session_state.username, 'planting_data', df_planting.to_dict('records')):
@@ -1297,11 +1686,9 @@ def data_management_page():
 
         with col2:
             st.info("效益数据模板")
-            sample_benefit = get_sample_benefit_data()
-            csv_benefit = sample_benefit.to_csv(index=False).encode('utf-8')
             st.download_button(
                 label="下载效益数据模板",
-                data=csv_benefit,
+                data=get_sample_csv('benefit'),
                 file_name="效益数据模板.csv",
                 mime="text/csv",
                 use_container_width=True
@@ -1310,7 +1697,7 @@ def data_management_page():
             uploaded_benefit = st.file_uploader("上传效益数据CSV", type=['csv'], key="benefit_upload")
             if uploaded_benefit is not None:
                 try:
-                    df_benefit = pd.read_csv(uploaded_benefit)
+                    df_benefit = read_uploaded_csv(uploaded_benefit)
                     required_cols = ['作物名称', '亩产量/斤', '种植成本/(元/亩)', '销售单价/(元/斤)', '地块类型']
                     if all(col in df_benefit.columns for col in required_cols):
                         if save_user_data(st.session_state.username, 'benefit_data', df_benefit.to_dict('records')):
@@ -1323,6 +1710,7 @@ def data_management_page():
                     st.error(f"文件读取错误: {str(e)}")
 
 
+@st.cache_data(show_spinner=False)
 def get_sample_planting_data():
     """获取示例种植数据"""
     return pd.DataFrame({
@@ -1335,6 +1723,7 @@ def get_sample_planting_data():
     })
 
 
+@st.cache_data(show_spinner=False)
 def get_sample_benefit_data():
     """获取示例效益数据"""
     return pd.DataFrame({
@@ -1346,11 +1735,39 @@ def get_sample_benefit_data():
     })
 
 
+@st.cache_data(show_spinner=False)
+def get_sample_csv(kind: str) -> bytes:
+    """获取示例数据的CSV模板内容（kind 为 'planting' 或 'benefit'）"""
+    df = get_sample_planting_data() if kind == 'planting' else get_sample_benefit_data()
+    return df.to_csv(index=False).encode('utf-8')
+
+
+@st.cache_data(show_spinner=False)
+def compute_benefit_df(benefit_df):
+    """计算亩效益列：亩产量 × 销售单价 - 种植成本（按数据内容缓存）"""
+    profit = np.multiply(benefit_df['亩产量/斤'].to_numpy(dtype=float),
+                         benefit_df['销售单价/(元/斤)'].to_numpy(dtype=float))
+    np.subtract(profit, benefit_df['种植成本/(元/亩)'].to_numpy(dtype=float), out=profit)
+    return benefit_df.assign(**{'亩效益/元': profit})
+
+
 def load_user_or_sample_data():
-    """加载用户数据或示例数据"""
+    """加载用户数据或示例数据，同时返回两类数据是否来自用户上传"""
+    username = st.session_state.username
+    # 以数据文件版本戳作为缓存键，用户保存新数据后自动重新加载
+    return load_data_cached(username,
+                            file_stamp(user_data_path(username, 'planting_data')),
+                            file_stamp(user_data_path(username, 'benefit_data')))
+
+
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)
+def load_data_cached(username, planting_stamp, benefit_stamp):
+    """按用户名和数据文件版本戳缓存数据加载结果（每次保存都会产生新键，限制条目数和存活时间）"""
     # 尝试加载用户数据
-    planting_data = get_user_data(st.session_state.username, 'planting_data')
-    benefit_data = get_user_data(st.session_state.username, 'benefit_data')
+    planting_data = get_user_data(username, 'planting_data')
+    benefit_data = get_user_data(username, 'benefit_data')
+    planting_is_user = planting_data is not None
+    benefit_is_user = benefit_data is not None
 
     # 如果用户数据不存在，使用示例数据
     if planting_data is None:
@@ -1364,13 +1781,69 @@ def load_user_or_sample_data():
         benefit_data = pd.DataFrame(benefit_data)
 
     # 计算亩效益
-    benefit_data['亩效益/元'] = benefit_data['亩产量/斤'] * benefit_data['销售单价/(元/斤)'] - benefit_data[
-        '种植成本/(元/亩)']
+    benefit_data = compute_benefit_df(benefit_data)
+
+    return planting_data, benefit_data, planting_is_user, benefit_is_user
+
+
+def top_n_positions(values, n=10):
+    """返回最大的n个值的位置（按值降序，并列时保持原顺序，忽略缺失值），用部分排序代替全排序"""
+    values = np.asarray(values, dtype=float)
+    positions = np.flatnonzero(~np.isnan(values))
+    values = values[positions]
+    if len(values) > n:
+        # 第n大的值作为门槛：大于门槛的全部保留，等于门槛的按原顺序补足
+        kth = -np.partition(-values, n - 1)[n - 1]
+        greater = np.flatnonzero(values > kth)
+        ties = np.flatnonzero(values == kth)[:n - len(greater)]
+        idx = np.sort(np.concatenate([greater, ties]))
+    else:
+        idx = np.arange(len(values))
+    return positions[idx[np.argsort(-values[idx], kind='stable')]]
+
 
-    return planting_data, benefit_data
+@st.cache_data(show_spinner=False)
+def dashboard_type_pie(planting_data):
+    """作物类型面积分布图（按数据内容缓存）"""
+    import plotly.express as px
 
+    type_dist = planting_data.groupby('作物类型')['种植面积/亩'].sum().reset_index()
+    return px.pie(type_dist, values='种植面积/亩', names='作物类型',
+                  title="作物类型面积分布", hole=0.4)
 
-def create_dashboard(planting_data, benefit_data):
+
+@st.cache_data(show_spinner=False)
+def dashboard_crop_area_bar(planting_data):
+    """主要作物种植面积图（按数据内容缓存）"""
+    import plotly.express as px
+
+    crop_area = planting_data.groupby('作物名称')['种植面积/亩'].sum()
+    crop_dist = crop_area.iloc[top_n_positions(crop_area.to_numpy())].reset_index()
+    return px.bar(crop_dist, x='作物名称', y='种植面积/亩',
+                  title="主要作物种植面积", color='种植面积/亩')
+
+
+@st.cache_data(show_spinner=False)
+def dashboard_benefit_rank_bar(benefit_data):
+    """作物亩效益排名图（按数据内容缓存）"""
+    import plotly.express as px
+
+    top_crops = benefit_data.iloc[top_n_positions(benefit_data['亩效益/元'].to_numpy())]
+    return px.bar(top_crops, x='作物名称', y='亩效益/元',
+                  title="作物亩效益排名", color='亩效益/元')
+
+
+@st.cache_data(show_spinner=False)
+def dashboard_cost_benefit_scatter(benefit_data):
+    """成本-收益散点图（按数据内容缓存）"""
+    import plotly.express as px
+
+    return px.scatter(benefit_data, x='种植成本/(元/亩)', y='亩效益/元',
+                      size='亩产量/斤', color='作物名称',
+                      title="成本-收益分析", hover_data=['销售单价/(元/斤)'])
+
+
+def create_dashboard(planting_data, benefit_data, planting_is_user, benefit_is_user):
     """数据驾驶舱"""
     st.header("📊 农业数据驾驶舱")
 
@@ -1383,10 +1856,7 @@ def create_dashboard(planting_data, benefit_data):
         st.success(f"👋 欢迎回来，{st.session_state.username}！")
 
     # 数据来源提示
-    user_planting_data = get_user_data(st.session_state.username, 'planting_data')
-    user_benefit_data = get_user_data(st.session_state.username, 'benefit_data')
-
-    if user_planting_data is None or user_benefit_data is None:
+    if not (planting_is_user and benefit_is_user):
         st.warning("💡 当前使用示例数据，请前往【数据管理】上传您的真实数据以获得个性化分析")
 
     # 关键指标
@@ -1411,17 +1881,11 @@ def create_dashboard(planting_data, benefit_data):
 
     with col1:
         # 作物类型分布
-        type_dist = planting_data.groupby('作物类型')['种植面积/亩'].sum().reset_index()
-        fig_pie = px.pie(type_dist, values='种植面积/亩', names='作物类型',
-                         title="作物类型面积分布", hole=0.4)
-        st.plotly_chart(fig_pie, use_container_width=True)
+        st.plotly_chart(dashboard_type_pie(planting_data), use_container_width=True)
 
     with col2:
         # 主要作物面积
-        crop_dist = planting_data.groupby('作物名称')['种植面积/亩'].sum().nlargest(10).reset_index()
-        fig_bar = px.bar(crop_dist, x='作物名称', y='种植面积/亩',
-                         title="主要作物种植面积", color='种植面积/亩')
-        st.plotly_chart(fig_bar, use_container_width=True)
+        st.plotly_chart(dashboard_crop_area_bar(planting_data), use_container_width=True)
 
     # 效益分析
     st.subheader("经济效益分析")
@@ -1429,28 +1893,26 @@ def create_dashboard(planting_data, benefit_data):
 
     with col1:
         # 亩效益排名
-        top_crops = benefit_data.nlargest(10, '亩效益/元')
-        fig_benefit = px.bar(top_crops, x='作物名称', y='亩效益/元',
-                             title="作物亩效益排名", color='亩效益/元')
-        st.plotly_chart(fig_benefit, use_container_width=True)
+        st.plotly_chart(dashboard_benefit_rank_bar(benefit_data), use_container_width=True)
 
     with col2:
         # 成本收益分析
-        fig_scatter = px.scatter(benefit_data, x='种植成本/(元/亩)', y='亩效益/元',
-                                 size='亩产量/斤', color='作物名称',
-                                 title="成本-收益分析", hover_data=['销售单价/(元/斤)'])
-        st.plotly_chart(fig_scatter, use_container_width=True)
+        st.plotly_chart(dashboard_cost_benefit_scatter(benefit_data), use_container_width=True)
 
 
-def create_planner(planting_data, benefit_data):
-    """智能规划器 - 集成真实算法"""
-    st.header("🧮 智能种植规划器")
+# 规划器侧边栏参数
+PlannerConfig = namedtuple('PlannerConfig', [
+    'years', 'risk_level', 'economic_weight', 'stability_weight', 'sustainability_weight',
+    'min_bean_rotation', 'avoid_same_crop', 'min_plot_size', 'total_area'
+])
 
-    # 使用用户偏好设置
-    preferences = st.session_state.user_data['preferences']
 
-    # 参数配置
-    with st.sidebar:
+def planner_controls(planting_data, preferences) -> Tuple[PlannerConfig, bool]:
+    """规划器参数配置（放在表单中，调整滑块不会触发整页重运行，点击应用后才生效）
+
+    表单中未提交的修改不会发送到服务端，因此提交表单即按新参数生成方案，返回参数和是否刚提交。
+    """
+    with st.sidebar, st.form("planner_config"):
         st.subheader("优化参数配置")
 
         years = st.slider("规划年限", 1, 7, 3)
@@ -1477,24 +1939,43 @@ def create_planner(planting_data, benefit_data):
                                      value=float(planting_data['种植面积/亩'].sum()),
                                      step=10.0)
 
+        submitted = st.form_submit_button("应用参数并生成方案", use_container_width=True)
+
+    config = PlannerConfig(years, risk_level, economic_weight, stability_weight, sustainability_weight,
+                           min_bean_rotation, avoid_same_crop, min_plot_size, total_area)
+    return config, submitted
+
+
+def create_planner(planting_data, benefit_data):
+    """智能规划器 - 集成真实算法"""
+    st.header("🧮 智能种植规划器")
+
+    # 使用用户偏好设置
+    preferences = st.session_state.user_data['preferences']
+
+    # 参数配置
+    config, submitted = planner_controls(planting_data, preferences)
+
     # 方案生成
     col1, col2 = st.columns([2, 1])
 
     with col1:
         st.subheader("智能规划")
 
-        if st.button("🚀 生成优化方案", type="primary", use_container_width=True):
+        st.caption("侧边栏参数修改后需点击“应用参数并生成方案”才会生效")
+        if st.button("🚀 生成优化方案", type="primary", use_container_width=True) or submitted:
             with st.spinner("正在使用优化算法计算最优种植方案..."):
                 # 使用真实算法
                 preferences = {
-                    'risk_level': risk_level,
-                    'economic_weight': economic_weight,
-                    'stability_weight': stability_weight,
-                    'sustainability_weight': sustainability_weight
+                    'risk_level': config.risk_level,
+                    'economic_weight': config.economic_weight,
+                    'stability_weight': config.stability_weight,
+                    'sustainability_weight': config.sustainability_weight
                 }
 
-                optimizer = AgriculturalOptimizer(planting_data, benefit_data, preferences)
-                result = optimizer.optimize_planting_plan(total_area, years)
+                optimizer = get_optimizer(planting_data, benefit_data, preferences)
+                suitability_scores = cached_crop_suitability(planting_data, benefit_data)
+                result = optimizer.optimize_planting_plan(config.total_area, config.years, suitability_scores)
 
                 if result['status'] == 'optimal':
                     # 显示优化结果
@@ -1507,14 +1988,12 @@ def create_planner(planting_data, benefit_data):
         st.info("💡 **基于算法的即时建议**")
 
         # 使用算法生成建议
-        optimizer = AgriculturalOptimizer(planting_data, benefit_data, preferences)
-        suitability_scores = optimizer.calculate_crop_suitability()
+        suitability_scores = cached_crop_suitability(planting_data, benefit_data)
 
         # 推荐高适应性作物
         top_crops = sorted(suitability_scores.items(), key=lambda x: x[1], reverse=True)[:3]
-        st.write("推荐高适应性作物:")
-        for crop, score in top_crops:
-            st.write(f"• {crop} (适应性评分: {score:.2f})")
+        st.markdown("\n\n".join(["推荐高适应性作物:"] +
+                                  [f"• {crop} (适应性评分: {score:.2f})" for crop, score in top_crops]))
 
         # 风险提示
         current_risk = np.mean(list(suitability_scores.values()))
@@ -1524,6 +2003,8 @@ def create_planner(planting_data, benefit_data):
 
 def display_real_optimization_result(result, optimizer):
     """显示真实优化算法结果"""
+    import plotly.express as px
+
     st.success(f"✅ 优化方案生成成功！预计整体收益提升 {result['expected_improvement']:.1f}%")
 
     # 显示分配结果
@@ -1539,11 +2020,12 @@ def display_real_optimization_result(result, optimizer):
         })
 
     allocation_df = pd.DataFrame(allocation_data)
-    st.dataframe(allocation_df.style.format({
-        '分配面积/亩': '{:.1f}',
-        '占比/%': '{:.1f}%',
-        '预期收益/元': '¥{:.0f}'
-    }), use_container_width=True)
+    # 数值格式交给前端渲染，无需每次重运行都构建Styler
+    st.dataframe(allocation_df, use_container_width=True, column_config={
+        '分配面积/亩': st.column_config.NumberColumn(format="%.1f"),
+        '占比/%': st.column_config.NumberColumn(format="%.1f%%"),
+        '预期收益/元': st.column_config.NumberColumn(format="¥%.0f")
+    })
 
     # 风险分析
     risk_result = optimizer.risk_analysis(result['crop_allocations'])
@@ -1600,26 +2082,62 @@ def display_real_optimization_result(result, optimizer):
                 st.success("✅ 低风险方案")
 
 
+# 气候情景：情景名称 -> (产量影响%, 成本影响%, 发生概率%)
+CLIMATE_SCENARIOS = {
+    '正常年份': (0, 0, 60),
+    '轻度干旱': (-15, 10, 20),
+    '严重干旱': (-40, 25, 5),
+    '洪涝灾害': (-25, 30, 8),
+    '低温冻害': (-20, 15, 4),
+    '高温热害': (-10, 5, 3),
+}
+
+
+@st.cache_data(show_spinner=False)
+def get_climate_scenarios_df():
+    """气候情景表格（只构建一次）"""
+    return pd.DataFrame(
+        [(name, *impact) for name, impact in CLIMATE_SCENARIOS.items()],
+        columns=['情景', '产量影响', '成本影响', '发生概率']
+    )
+
+
+@st.cache_data(show_spinner=False)
+def crop_economics_table(benefit_data):
+    """按作物名称索引的产量、单价、成本和亩效益（同名作物取第一条记录）"""
+    return benefit_data.drop_duplicates('作物名称').set_index('作物名称')[
+        ['亩产量/斤', '销售单价/(元/斤)', '种植成本/(元/亩)', '亩效益/元']]
+
+
 def create_risk_simulator(benefit_data):
     """风险模拟器 - 集成价格预测算法"""
+    import plotly.express as px
+
     st.header("⚠️ 风险模拟分析")
 
     tab1, tab2, tab3 = st.tabs(["💰 价格波动预测", "🌦️ 气候影响", "📜 政策变化"])
 
+    # 作物名称列表（取自缓存的作物表，已去重且保持原顺序）
+    crop_names = crop_economics_table(benefit_data).index
+
     with tab1:
         st.subheader("市场价格预测与波动模拟")
 
         # 价格预测
         col1, col2 = st.columns(2)
         with col1:
-            selected_crop = st.selectbox("选择作物", benefit_data['作物名称'].unique())
+            selected_crop = st.selectbox("选择作物", crop_names)
             prediction_months = st.slider("预测月数", 3, 24, 12)
 
         with col2:
             if st.button("开始价格预测", type="primary"):
                 with st.spinner("训练价格预测模型中..."):
-                    predictor = PricePredictor()
-                    if predictor.train(benefit_data):
+                    try:
+                        predictor = get_trained_predictor(benefit_data)
+                    except RuntimeError:
+                        predictor = None
+
+                    if predictor is not None:
                         predictions = predictor.predict(selected_crop, prediction_months)
 
                         if predictions is not None:
@@ -1652,15 +2170,15 @@ def create_risk_simulator(benefit_data):
 
         with col2:
             cost_change = st.slider("成本变化幅度", -20, 20, 0, format="%d%%")
-            selected_crop_risk = st.selectbox("分析作物", benefit_data['作物名称'].unique(), key="risk_crop")
+            selected_crop_risk = st.selectbox("分析作物", crop_names, key="risk_crop")
 
         # 模拟影响
-        crop_data = benefit_data[benefit_data['作物名称'] == selected_crop_risk].iloc[0]
-        original_profit = crop_data['亩效益/元']
+        crop_values = crop_economics_table(benefit_data).loc[selected_crop_risk].to_numpy(dtype=float)
+        original_profit = crop_values[3]
 
-        new_price = crop_data['销售单价/(元/斤)'] * (1 + price_change / 100)
-        new_yield = crop_data['亩产量/斤'] * (1 + yield_change / 100)
-        new_cost = crop_data['种植成本/(元/亩)'] * (1 + cost_change / 100)
+        # 产量、单价、成本按各自的变化幅度一次性调整
+        new_yield, new_price, new_cost = crop_values[:3] * (
+            1 + np.array([yield_change, price_change, cost_change]) / 100)
 
         new_profit = new_yield * new_price - new_cost
         profit_change = (new_profit - original_profit) / original_profit * 100
@@ -1674,30 +2192,18 @@ def create_risk_simulator(benefit_data):
 
     with tab2:
         st.subheader("气候情景模拟")
-        scenario = st.selectbox(
-            "选择气候情景",
-            ["正常年份", "轻度干旱", "严重干旱", "洪涝灾害", "低温冻害", "高温热害"]
-        )
-
-        scenarios_data = {
-            '情景': ['正常年份', '轻度干旱', '严重干旱', '洪涝灾害', '低温冻害', '高温热害'],
-            '产量影响': [0, -15, -40, -25, -20, -10],
-            '成本影响': [0, 10, 25, 30, 15, 5],
-            '发生概率': [60, 20, 5, 8, 4, 3]
-        }
-
-        scenarios_df = pd.DataFrame(scenarios_data)
-        selected_scenario = scenarios_df[scenarios_df['情景'] == scenario].iloc[0]
+        scenario = st.selectbox("选择气候情景", list(CLIMATE_SCENARIOS))
+        yield_impact, cost_impact, probability = CLIMATE_SCENARIOS[scenario]
 
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("产量影响", f"{selected_scenario['产量影响']}%")
+            st.metric("产量影响", f"{yield_impact}%")
         with col2:
-            st.metric("成本影响", f"+{selected_scenario['成本影响']}%")
+            st.metric("成本影响", f"+{cost_impact}%")
         with col3:
-            st.metric("发生概率", f"{selected_scenario['发生概率']}%")
+            st.metric("发生概率", f"{probability}%")
 
-        st.dataframe(scenarios_df, use_container_width=True)
+        st.dataframe(get_climate_scenarios_df(), use_container_width=True)
 
     with tab3:
         st.subheader("政策变化模拟")
@@ -1713,19 +2219,59 @@ def create_risk_simulator(benefit_data):
             st.success("已选择政策变化分析")
             # 这里可以添加具体的政策影响分析逻辑
 
+# 常见作物病变类型：(名称, 置信度范围, 防治建议)
+CROP_DISEASES = (
+    ("白粉病", (0.75, 0.98), "及时喷施三唑类杀菌剂，加强田间通风透光，降低湿度"),
+    ("霜霉病", (0.72, 0.95), "选用甲霜灵锰锌、烯酰吗啉等药剂喷雾，避免大水漫灌"),
+    ("叶斑病", (0.68, 0.93), "摘除病叶集中烧毁，喷施多菌灵、百菌清等保护性杀菌剂"),
+    ("蚜虫侵害", (0.70, 0.96), "使用吡虫啉、啶虫脒等药剂，搭配黄板诱杀，保护瓢虫等天敌"),
+    ("无明显病变", (0.80, 0.99), "作物生长状态良好，继续保持现有田间管理，定期巡查即可"),
+    ("病毒病", (0.65, 0.88), "及时拔除病株，防治蚜虫、蓟马等传毒媒介，喷施宁南霉素预防"),
+    ("炭疽病", (0.73, 0.94), "喷施咪鲜胺、苯醚甲环唑等药剂，避免偏施氮肥，增施磷钾肥"),
+)
+
+
 def random_disease_detection():
     """随机生成病变识别结果"""
-    # 常见作物病变类型
-    diseases = [
-        {"name": "白粉病", "confidence": round(random.uniform(0.75, 0.98), 2), "suggestion": "及时喷施三唑类杀菌剂，加强田间通风透光，降低湿度"},
-        {"name": "霜霉病", "confidence": round(random.uniform(0.72, 0.95), 2), "suggestion": "选用甲霜灵锰锌、烯酰吗啉等药剂喷雾，避免大水漫灌"},
-        {"name": "叶斑病", "confidence": round(random.uniform(0.68, 0.93), 2), "suggestion": "摘除病叶集中烧毁，喷施多菌灵、百菌清等保护性杀菌剂"},
-        {"name": "蚜虫侵害", "confidence": round(random.uniform(0.70, 0.96), 2), "suggestion": "使用吡虫啉、啶虫脒等药剂，搭配黄板诱杀，保护瓢虫等天敌"},
-        {"name": "无明显病变", "confidence": round(random.uniform(0.80, 0.99), 2), "suggestion": "作物生长状态良好，继续保持现有田间管理，定期巡查即可"},
-        {"name": "病毒病", "confidence": round(random.uniform(0.65, 0.88), 2), "suggestion": "及时拔除病株，防治蚜虫、蓟马等传毒媒介，喷施宁南霉素预防"},
-        {"name": "炭疽病", "confidence": round(random.uniform(0.73, 0.94), 2), "suggestion": "喷施咪鲜胺、苯醚甲环唑等药剂，避免偏施氮肥，增施磷钾肥"}
-    ]
-    return random.choice(diseases)
+    # 先选定病变类型，只为选中的一项生成置信度
+    name, confidence_range, suggestion = random.choice(CROP_DISEASES)
+    return {"name": name, "confidence": round(random.uniform(*confidence_range), 2), "suggestion": suggestion}
+
+
+@st.experimental_fragment
+def disease_result_panel(has_image):
+    """识别按钮和识别结果（点击识别时只重运行这一部分，不重绘上传区域）"""
+    # 识别按钮
+    if has_image and st.button("开始识别", type="primary", use_container_width=True):
+        with st.spinner("正在分析叶片状态..."):
+            # 随机生成识别结果并存储到会话状态
+            st.session_state.disease_result = random_disease_detection()
+
+    st.subheader("识别结果")
+    if "disease_result" in st.session_state:
+        result = st.session_state.disease_result
+
+        # 结果卡片、应对建议和额外提示合并为一段HTML，一次输出
+        st.markdown(f"""
+        <div style="background-color:#f0f8fb; padding:20px; border-radius:10px; margin-bottom:20px;">
+            <h4 style="margin:0; color:#2d3748;">病变类型：{result['name']}</h4>
+            <p style="margin:10px 0; color:#4a5568;">置信度：{result['confidence']:.2f}</p>
+        </div>
+        <h4 style="color:#2d3748;">田间管理建议</h4>
+        <div style="background-color:#f5fafe; padding:15px; border-radius:8px; border-left:4px solid #4299e1; margin-bottom:20px;">
+            <p style="margin:0; color:#2d3748;">{result['suggestion']}</p>
+        </div>
+        <div style="background-color:#e8f1fb; padding:15px; border-radius:8px; color:#1e4f8a;">
+            💡 提示：本功能为演示版本，实际应用需结合深度学习模型和真实病害数据训练
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.markdown("""
+        <div style="background-color:#f8f8f8; padding:40px; border-radius:10px; text-align:center; color:#718096;">
+            <p>请上传叶片图片并点击"开始识别"</p>
+            <p style="font-size:12px; margin-top:10px;">支持JPG、JPEG、PNG格式</p>
+        </div>
+        """, unsafe_allow_html=True)
 
 
 def create_disease_detection():
@@ -1739,61 +2285,78 @@ def create_disease_detection():
         uploaded_file = st.file_uploader("选择叶片图片", type=["jpg", "jpeg", "png"])
 
         if uploaded_file is not None:
+            # 同一张图片只读取一次，之后的重运行直接使用会话中保存的字节
+            if st.session_state.get("disease_image_id") != uploaded_file.file_id:
+                st.session_state.disease_image_bytes = uploaded_file.getvalue()
+                st.session_state.disease_image_id = uploaded_file.file_id
+
             # 显示上传的图片
-            st.image(uploaded_file, caption="上传的叶片图片", use_column_width=True)
-
-            # 识别按钮
-            if st.button("开始识别", type="primary", use_container_width=True):
-                with st.spinner("正在分析叶片状态..."):
-                    # 随机生成识别结果
-                    result = random_disease_detection()
-                    # 存储结果到会话状态
-                    st.session_state.disease_result = result
-                    st.rerun()
+            st.image(st.session_state.disease_image_bytes, caption="上传的叶片图片", use_column_width=True)
         else:
             st.session_state.pop("disease_result", None)
+            st.session_state.pop("disease_image_bytes", None)
+            st.session_state.pop("disease_image_id", None)
 
     # 显示识别结果
     with col2:
-        st.subheader("识别结果")
-        if "disease_result" in st.session_state:
-            result = st.session_state.disease_result
-
-            # 结果卡片
-            st.markdown(f"""
-            <div style="background-color:#f0f8fb; padding:20px; border-radius:10px; margin-bottom:20px;">
-                <h4 style="margin:0; color:#2d3748;">病变类型：{result['name']}</h4>
-                <p style="margin:10px 0; color:#4a5568;">置信度：{result['confidence']:.2f}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-            # 应对建议
-            st.subheader("田间管理建议")
-            st.markdown(f"""
-            <div style="background-color:#f5fafe; padding:15px; border-radius:8px; border-left:4px solid #4299e1;">
-                <p style="margin:0; color:#2d3748;">{result['suggestion']}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-            # 额外提示
-            st.info("💡 提示：本功能为演示版本，实际应用需结合深度学习模型和真实病害数据训练")
-        else:
-            st.markdown("""
-            <div style="background-color:#f8f8f8; padding:40px; border-radius:10px; text-align:center; color:#718096;">
-                <p>请上传叶片图片并点击"开始识别"</p>
-                <p style="font-size:12px; margin-top:10px;">支持JPG、JPEG、PNG格式</p>
-            </div>
-            """, unsafe_allow_html=True)
+        disease_result_panel(uploaded_file is not None)
+
+
+@st.cache_data(show_spinner=False)
+def benefit_histogram_figure(benefit_data, bins=20):
+    """亩效益分布直方图：先用NumPy分箱，只把各箱计数传给前端"""
+    import plotly.graph_objects as go
+
+    profit = benefit_data['亩效益/元'].to_numpy(dtype=float)
+    counts, edges = np.histogram(profit[~np.isnan(profit)], bins=bins)
+
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges)))
+    fig.update_layout(title="亩效益分布", xaxis_title='亩效益/元', yaxis_title='count', bargap=0)
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def benefit_box_figure(benefit_data):
+    """各地块类型亩效益箱线图：预先计算四分位数和须线端点，只把统计量传给前端"""
+    import plotly.graph_objects as go
+
+    names, q1s, medians, q3s, lower_fences, upper_fences = [], [], [], [], [], []
+    for land_type, profit in benefit_data.groupby('地块类型', sort=False)['亩效益/元']:
+        values = profit.dropna().to_numpy(dtype=float)
+        if len(values) == 0:
+            continue
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        names.append(land_type)
+        q1s.append(q1)
+        medians.append(median)
+        q3s.append(q3)
+        # 须线延伸到1.5倍四分位距以内的最远数据点，与plotly默认一致
+        lower_fences.append(values[values >= q1 - 1.5 * iqr].min())
+        upper_fences.append(values[values <= q3 + 1.5 * iqr].max())
+
+    fig = go.Figure(go.Box(x=names, q1=q1s, median=medians, q3=q3s,
+                           lowerfence=lower_fences, upperfence=upper_fences))
+    fig.update_layout(title="不同地块类型效益对比", xaxis_title='地块类型', yaxis_title='亩效益/元')
+    return fig
+
+
 def create_benefit_analysis(benefit_data, planting_data):
     """效益分析"""
+    import plotly.express as px
+
     st.header("💵 经济效益深度分析")
 
     # 总体效益概览
     col1, col2, col3 = st.columns(3)
 
-    total_potential = benefit_data['亩效益/元'].sum()
-    avg_efficiency = benefit_data['亩效益/元'].mean()
-    max_benefit_crop = benefit_data.loc[benefit_data['亩效益/元'].idxmax(), '作物名称']
+    # 亩效益和成本只取一次底层数组，后续统计都基于数组计算
+    profit = benefit_data['亩效益/元'].to_numpy(dtype=float)
+    cost = benefit_data['种植成本/(元/亩)'].to_numpy(dtype=float)
+
+    total_potential = np.nansum(profit)
+    avg_efficiency = np.nanmean(profit) if len(profit) else np.nan
+    max_benefit_crop = benefit_data['作物名称'].iat[int(np.nanargmax(profit))] if len(profit) else None
 
     with col1:
         st.metric("总效益潜力", f"¥{total_potential:.0f}")
@@ -1808,21 +2371,19 @@ def create_benefit_analysis(benefit_data, planting_data):
 
     with col1:
         # 效益分布直方图
-        fig_hist = px.histogram(benefit_data, x='亩效益/元',
-                                title="亩效益分布", nbins=20)
-        st.plotly_chart(fig_hist, use_container_width=True)
+        st.plotly_chart(benefit_histogram_figure(benefit_data), use_container_width=True)
 
     with col2:
         # 地块类型效益对比
-        fig_box = px.box(benefit_data, x='地块类型', y='亩效益/元',
-                         title="不同地块类型效益对比")
-        st.plotly_chart(fig_box, use_container_width=True)
+        st.plotly_chart(benefit_box_figure(benefit_data), use_container_width=True)
 
     # 投入产出分析
     st.subheader("投入产出效率分析")
 
-    benefit_data['投入产出比'] = benefit_data['亩效益/元'] / benefit_data['种植成本/(元/亩)']
-    efficient_crops = benefit_data.nlargest(10, '投入产出比')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = profit / cost
+    benefit_data = benefit_data.assign(投入产出比=ratio)
+    efficient_crops = benefit_data.iloc[top_n_positions(ratio)]
 
     fig_efficiency = px.bar(efficient_crops, x='作物名称', y='投入产出比',
                             title="作物投入产出比排名", color='投入产出比')
@@ -1881,6 +2442,58 @@ def create_about_page():
     st.info("💡 提示: 这是一个演示原型，实际应用需要接入真实数据和更复杂的算法模型")
 
 
+# 账号管理页面的统计指标和账号列表
+AccountOverview = namedtuple('AccountOverview', [
+    'total_users', 'predefined_users', 'redeemed_users', 'temp_users', 'account_df'
+])
+
+
+def apply_pending_redeem_resets():
+    """把排队的兑换状态重置一次性写入用户文件，返回实际修改的账号数"""
+    pending = st.session_state.get('pending_redeem_resets')
+    if not pending:
+        return 0
+
+    users = load_users_for_update()
+    count = 0
+    for username in pending:
+        if username in users and users[username].get('redeemed', False):
+            users[username]['redeemed'] = False
+            count += 1
+    if count:
+        save_users(users)
+    st.session_state.pending_redeem_resets = []
+    return count
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_account_overview(users_stamp, _users) -> AccountOverview:
+    """账号统计和账号列表（以用户文件版本戳为缓存键，用户数据不参与哈希；旧版本的结果不会再被读取，只保留少量条目）"""
+    # 统计指标和账号列表在同一次遍历中完成
+    predefined_users = redeemed_users = temp_users = 0
+    account_data = []
+    for username, user_info in _users.items():
+        is_predefined = bool(user_info.get('is_predefined', False))
+        redeemed = bool(user_info.get('redeemed', False))
+        predefined_users += is_predefined
+        redeemed_users += is_predefined and redeemed
+        temp_users += bool(user_info.get('is_temporary', False))
+
+        account_type = "预定义" if is_predefined else "临时"
+        status = "已兑换" if redeemed else "未兑换" if is_predefined else "活跃"
+
+        account_data.append({
+            '用户名': username,
+            '用户类型': user_info['user_type'],
+            '账号类型': account_type,
+            '状态': status,
+            '注册时间': user_info['created_at'][:10]
+        })
+
+    return AccountOverview(len(_users), predefined_users, redeemed_users, temp_users,
+                           pd.DataFrame(account_data))
+
+
 def account_management_page():
     """账号管理页面"""
     st.header("👥 账号管理系统")
@@ -1889,42 +2502,26 @@ def account_management_page():
         st.error("需要管理员权限")
         return
 
+    # 先取版本戳再加载，加载期间文件被改写时缓存键不会比数据更新
+    users_stamp = file_stamp(USERS_FILE)
     users = load_users()
 
     # 显示所有账号状态
     st.subheader("账号状态总览")
 
-    # 统计信息
-    col1, col2, col3, col4 = st.columns(4)
-    total_users = len(users)
-    predefined_users = len([u for u in users.values() if u.get('is_predefined', False)])
-    redeemed_users = len([u for u in users.values() if u.get('is_predefined', False) and u.get('redeemed', False)])
-    temp_users = len([u for u in users.values() if u.get('is_temporary', False)])
+    # 统计信息（与账号列表一起按用户文件版本缓存）
+    overview = build_account_overview(users_stamp, users)
 
-    col1.metric("总用户数", total_users)
-    col2.metric("预定义账号", predefined_users)
-    col3.metric("已兑换", redeemed_users)
-    col4.metric("临时用户", temp_users)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("总用户数", overview.total_users)
+    col2.metric("预定义账号", overview.predefined_users)
+    col3.metric("已兑换", overview.redeemed_users)
+    col4.metric("临时用户", overview.temp_users)
 
     # 账号列表
     st.subheader("账号列表")
 
-    account_data = []
-    for username, user_info in users.items():
-        account_type = "预定义" if user_info.get('is_predefined', False) else "临时"
-        status = "已兑换" if user_info.get('redeemed', False) else "未兑换" if user_info.get('is_predefined',
-                                                                                             False) else "活跃"
-
-        account_data.append({
-            '用户名': username,
-            '用户类型': user_info['user_type'],
-            '账号类型': account_type,
-            '状态': status,
-            '注册时间': user_info['created_at'][:10]
-        })
-
-    account_df = pd.DataFrame(account_data)
-    st.dataframe(account_df, use_container_width=True)
+    st.dataframe(overview.account_df, use_container_width=True)
 
     # 兑换码管理
     st.subheader("兑换码管理")
@@ -1932,22 +2529,38 @@ def account_management_page():
     col1, col2 = st.columns(2)
 
     with col1:
-        st.write("**可用兑换码**")
+        # 所有兑换码拼成一段markdown，一次输出
+        lines = ["**可用兑换码**"]
         for code, username in REDEMPTION_CODES.items():
-            user_status = "已兑换" if users[username].get('redeemed', False) else "未使用"
-            status_color = "🔴" if users[username].get('redeemed', False) else "🟢"
-            st.write(f"{status_color} `{code}` → {username} ({user_status})")
+            redeemed = users[username].get('redeemed', False)
+            lines.append(f"{'🔴' if redeemed else '🟢'} `{code}` → {username} ({'已兑换' if redeemed else '未使用'})")
+        st.markdown("\n\n".join(lines))
 
     with col2:
         st.write("**重置账号状态**")
         reset_username = st.selectbox("选择账号", [u for u in PREDEFINED_ACCOUNTS.keys()])
 
+        # 重置操作先加入待应用队列，点击应用时一次性写回用户文件
+        pending = st.session_state.setdefault('pending_redeem_resets', [])
         if st.button("重置为未兑换状态", type="secondary"):
-            if reset_username in users:
-                users[reset_username]['redeemed'] = False
-                save_users(users)
-                st.success(f"已重置 {reset_username} 的兑换状态")
+            if reset_username in users and reset_username not in pending:
+                pending.append(reset_username)
+
+        if pending:
+            st.caption(f"待应用的重置: {'、'.join(pending)}")
+            if st.button("应用更改", type="primary"):
+                count = apply_pending_redeem_resets()
+                st.success(f"已重置 {count} 个账号的兑换状态")
                 st.rerun()
+
+
+# 侧边栏导航菜单（管理员额外包含账号管理）
+ADMIN_MENU_ITEMS = ("数据驾驶舱", "智能规划器", "风险模拟器", "效益分析", "聊天咨询", "作物病变识别", "数据管理",
+                    "账号管理", "个人中心", "关于项目")
+USER_MENU_ITEMS = ("数据驾驶舱", "智能规划器", "风险模拟器", "效益分析", "聊天咨询", "作物病变识别", "数据管理",
+                   "个人中心", "关于项目")
+
+
 def main():
     """主应用"""
     # 初始化用户系统 - 确保预定义账号被加载
@@ -1967,7 +2580,7 @@ def main():
         return
 
     # 加载数据
-    planting_data, benefit_data = load_user_or_sample_data()
+    planting_data, benefit_data, planting_is_user, benefit_is_user = load_user_or_sample_data()
 
     # 侧边栏导航
     st.sidebar.title(f"🌾 方寸云耕")
@@ -1977,23 +2590,16 @@ def main():
     # 根据用户类型显示不同的导航菜单
     user_type = st.session_state.user_data['user_type']
 
-    if user_type == "管理员":
-        menu_items = ["数据驾驶舱", "智能规划器", "风险模拟器", "效益分析", "聊天咨询", "作物病变识别", "数据管理",
-                      "账号管理", "个人中心", "关于项目"]
-    else:
-        menu_items = ["数据驾驶舱", "智能规划器", "风险模拟器", "效益分析", "聊天咨询", "作物病变识别", "数据管理",
-                      "个人中心", "关于项目"]
+    menu_items = ADMIN_MENU_ITEMS if user_type == "管理员" else USER_MENU_ITEMS
 
-    page = st.sidebar.radio("导航菜单", menu_items, index=0)
+    # 切换页面时自动应用账号管理页中尚未应用的更改
+    page = st.sidebar.radio("导航菜单", menu_items, index=0, on_change=apply_pending_redeem_resets)
 
     # 在侧边栏添加一些实用信息
     st.sidebar.markdown("---")
 
-    # 显示数据状态
-    user_planting_data = get_user_data(st.session_state.username, 'planting_data')
-    user_benefit_data = get_user_data(st.session_state.username, 'benefit_data')
-
-    if user_planting_data is not None and user_benefit_data is not None:
+    # 显示数据状态（直接使用加载数据时得到的来源标记）
+    if planting_is_user and benefit_is_user:
         st.sidebar.success("✅ 使用用户数据")
     else:
         st.sidebar.warning("📊 使用示例数据")
@@ -2005,26 +2611,20 @@ def main():
     **版本**: v2.1 算法版
     """)
 
-    # 页面路由
-    if page == "数据驾驶舱":
-        create_dashboard(planting_data, benefit_data)
-    elif page == "智能规划器":
-        create_planner(planting_data, benefit_data)
-    elif page == "风险模拟器":
-        create_risk_simulator(benefit_data)
-    elif page == "效益分析":
-        create_benefit_analysis(benefit_data, planting_data)
-    elif page == "数据管理":
-        data_management_page()
-    elif page == "个人中心":
-        user_profile_page()
-    elif page == "账号管理":
-        account_management_page()
-    elif page == "作物病变识别":
-        create_disease_detection()
-    elif page == "聊天咨询":
-        chat_page()
-    else:
-        create_about_page()
+    # 页面路由：页面名称 -> 渲染函数，未知页面显示关于页面
+    pages = {
+        "数据驾驶舱": lambda: create_dashboard(planting_data, benefit_data, planting_is_user, benefit_is_user),
+        "智能规划器": lambda: create_planner(planting_data, benefit_data),
+        "风险模拟器": lambda: create_risk_simulator(benefit_data),
+        "效益分析": lambda: create_benefit_analysis(benefit_data, planting_data),
+        "数据管理": data_management_page,
+        "个人中心": user_profile_page,
+        "账号管理": account_management_page,
+        "作物病变识别": create_disease_detection,
+        "聊天咨询": chat_page,
+    }
+    pages.get(page, create_about_page)()
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file